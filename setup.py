@@ -26,9 +26,10 @@ setup(
     py_modules=['transifexlib'],
     install_requires=[
         'transifex-python',
-        'requests',
+        'aiohttp',
         'beautifulsoup4',
         'ruamel.yaml',
+        'ruamel.yaml.clib',
         'localizable @ git+https://github.com/chrisballinger/python-localizable.git@15d3bf2466d0de1a826d3f0ff1f365b0c1910f56#egg=localizable'
     ],
 )
@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2021 Psiphon Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Tests for transifexlib. Run with `python -m unittest` (or pytest).
+'''
+
+import os
+import time
+import asyncio
+import tempfile
+import threading
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import transifexlib
+
+
+class _FakeContent:
+    def __init__(self, chunks, fail_after=None):
+        self._chunks = chunks
+        self._fail_after = fail_after
+
+    async def iter_chunked(self, n):
+        for i, chunk in enumerate(self._chunks):
+            if i == self._fail_after:
+                raise ConnectionResetError('connection dropped')
+            yield chunk
+
+
+class _FakeResponse:
+    status = 200
+    charset = 'utf-8'
+
+    def __init__(self, content):
+        self.content = content
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+
+class _FakeSession:
+    def __init__(self, content):
+        self._content = content
+
+    def get(self, url):
+        return _FakeResponse(self._content)
+
+
+async def _fake_download_url(resource, lang):
+    return 'https://example.com/download'
+
+
+@mock.patch('transifexlib._tx_get_download_url', _fake_download_url)
+class TestDownloadTranslationToFile(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.output_path = os.path.join(self._dir.name, 'Localizable.strings')
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def _download(self, content, bom=False):
+        asyncio.run(transifexlib._tx_download_translation_to_file(
+            _FakeSession(content), None, 'fr', self.output_path, bom))
+
+    def test_crlf_split_across_chunks(self):
+        chunks = [b'ab\r', b'\ncd\r\n', b'\r', b'\r', b'\nx\r']
+        self._download(_FakeContent(chunks))
+        with open(self.output_path, 'rb') as f:
+            self.assertEqual(f.read(), b'ab\ncd\n\r\nx\r')
+
+    def test_bom(self):
+        self._download(_FakeContent([b'a\r\n', b'b']), bom=True)
+        with open(self.output_path, 'rb') as f:
+            self.assertEqual(f.read(), b'\xef\xbb\xbfa\nb')
+
+    def test_dropped_connection_keeps_existing_file(self):
+        with open(self.output_path, 'wb') as f:
+            f.write(b'old translation')
+
+        with self.assertRaises(ConnectionResetError):
+            self._download(_FakeContent([b'new ', b'translation'], fail_after=1))
+
+        with open(self.output_path, 'rb') as f:
+            self.assertEqual(f.read(), b'old translation')
+        self.assertEqual(os.listdir(self._dir.name), ['Localizable.strings'])
+
+
+class _ProcessResourceTestCase(unittest.TestCase):
+    """Runs `process_resource_async` against a mocked Transifex API.
+    """
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.stats = {}
+        self.prepared = []
+
+        patches = [
+            mock.patch('transifexlib._get_tx_objects', lambda *args: (None, None, 'resource')),
+            mock.patch('transifexlib._tx_get_resource_stats', lambda proj, resource: self.stats),
+            mock.patch.object(transifexlib.transifex_api, 'Language', lambda id: id),
+            mock.patch.object(transifexlib.transifex_api.ResourceTranslationsAsyncDownload, 'download',
+                              self._prepare_download),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def _prepare_download(self, resource, language):
+        self.prepared.append(language.removeprefix('l:'))
+        return 'https://example.com/download'
+
+    def _output_path(self, lang):
+        return os.path.join(self._dir.name, lang, 'Localizable.strings')
+
+    def _process(self, langs, **kwargs):
+        asyncio.run(transifexlib.process_resource_async(
+            'https://www.transifex.com/org/proj/res/', langs, None, self._output_path, None,
+            session=_FakeSession(_FakeContent([b'"K" = "V";\n'])), **kwargs))
+
+
+class TestDownloadConcurrency(_ProcessResourceTestCase):
+
+    def test_download_preparation_limited(self):
+        lock = threading.Lock()
+        in_flight = [0, 0]  # current, peak
+
+        def _prepare_download(resource, language):
+            with lock:
+                in_flight[0] += 1
+                in_flight[1] = max(in_flight[1], in_flight[0])
+            # Like the real thing, this blocks its thread while it polls
+            time.sleep(0.05)
+            with lock:
+                in_flight[0] -= 1
+            return 'https://example.com/download'
+
+        langs = {f'l{i}': f'l{i}' for i in range(3 * transifexlib.MAX_CONCURRENT_DOWNLOADS)}
+        with mock.patch.object(transifexlib.transifex_api.ResourceTranslationsAsyncDownload, 'download',
+                               _prepare_download):
+            self._process(langs)
+
+        # Not limited by the size of the default executor
+        self.assertEqual(in_flight[1], transifexlib.MAX_CONCURRENT_DOWNLOADS)
+
+
+class TestResourceStats(unittest.TestCase):
+
+    def test_language_codes(self):
+        # Language codes starting with 'l' must survive the 'l:' prefix being removed
+        stats = [SimpleNamespace(language=SimpleNamespace(id=f'l:{lang}'),
+                                 translated_strings=5, untranslated_strings=5, total_strings=10,
+                                 reviewed_strings=0, proofread_strings=0)
+                 for lang in ('lt', 'lo', 'lv', 'fr')]
+        with mock.patch.object(transifexlib.transifex_api.ResourceLanguageStats, 'filter',
+                               lambda project, resource: stats):
+            res = transifexlib._tx_get_resource_stats(None, None)
+        self.assertEqual(sorted(res), ['fr', 'lo', 'lt', 'lv'])
+        self.assertEqual(res['lt']['completion'], 0.5)
+
+
+class TestCompletionThreshold(_ProcessResourceTestCase):
+
+    def test_skip_below_min_completion(self):
+        self.stats = {
+            lang: {'completion': completion, 'translated_strings': 0,
+                   'untranslated_strings': 0, 'total_strings': 0}
+            for lang, completion in (('fr', 0.005), ('lt', 0.02), ('de', 0.5))
+        }
+        # 'ru' is missing from the stats, so should be downloaded anyway
+        self._process({'fr': 'fr', 'lt': 'lt', 'de': 'de', 'ru': 'ru'}, min_completion=0.01)
+
+        self.assertEqual(sorted(self.prepared), ['de', 'lt', 'ru'])
+        self.assertFalse(os.path.exists(self._output_path('fr')))
+        self.assertTrue(os.path.exists(self._output_path('ru')))
+
+
+class TestParseCache(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self._dir.name, 'en.strings')
+        patch = mock.patch.dict(transifexlib._parse_cache, {'strings': {}, 'yaml': {}})
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def _write(self, value, mtime):
+        with open(self.path, 'w') as f:
+            f.write(f'/* c */\n"K" = "{value}";\n')
+        os.utime(self.path, (mtime, mtime))
+
+    def test_modified_file_replaces_entry(self):
+        self._write('one', 1000)
+        first = transifexlib._cached_strings_by_key(self.path)
+        self.assertEqual(first, {'K': 'one'})
+        self.assertIs(transifexlib._cached_strings_by_key(self.path), first)
+
+        self._write('two', 2000)
+        self.assertEqual(transifexlib._cached_strings_by_key(self.path), {'K': 'two'})
+        self.assertEqual(len(transifexlib._parse_cache['strings']), 1)
+
+
+class TestTransifexObjects(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+
+        def _api_call(name):
+            def _call(*args, **kwargs):
+                self.calls.append(name)
+                # Give concurrent callers a chance to miss the cache together
+                time.sleep(0.05)
+                return SimpleNamespace(id=kwargs.get('id'))
+            return _call
+
+        api = transifexlib.transifex_api
+        patches = [
+            mock.patch('transifexlib.get_config', lambda: {'api': 'token'}),
+            mock.patch('transifexlib._tx_get_resource_stats', lambda proj, resource: {}),
+            mock.patch.object(api, 'setup', _api_call('setup')),
+            mock.patch.object(api.Organization, 'get', _api_call('org')),
+            mock.patch.object(api.Project, 'get', _api_call('proj')),
+            mock.patch.object(api.Resource, 'get', _api_call('resource')),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+        for getter in (transifexlib._tx_setup, transifexlib._get_tx_org,
+                       transifexlib._get_tx_proj, transifexlib._get_tx_resource):
+            getter.cache_clear()
+            self.addCleanup(getter.cache_clear)
+
+    def test_fetched_once_across_resources(self):
+        transifexlib.process_resources([
+            dict(resource_url=f'https://www.transifex.com/org/proj/res{i}/', langs={},
+                 master_fpath=None, output_path_fn=None, output_mutator_fn=None)
+            for i in range(6)
+        ])
+
+        self.assertEqual(self.calls.count('setup'), 1)
+        self.assertEqual(self.calls.count('org'), 1)
+        self.assertEqual(self.calls.count('proj'), 1)
+        self.assertEqual(self.calls.count('resource'), 6)
+
+
+class TestMergeYamlTranslations(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.master_fpath = os.path.join(self._dir.name, 'en.yaml')
+        self.trans_fpath = os.path.join(self._dir.name, 'fr.yaml')
+        with open(self.master_fpath, 'w') as f:
+            f.write('a: "A"\nb: B\n')
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def _merge(self, existing, fresh_raw):
+        with open(self.trans_fpath, 'w') as f:
+            f.write(existing)
+        return transifexlib.merge_yaml_translations(
+            self.master_fpath, 'fr', 'fr', self.trans_fpath, fresh_raw)
+
+    def test_merged(self):
+        self.assertEqual(self._merge('a: "x"\nb: old\n', 'a: "x"\n'), 'a: x\nb: old\n')
+
+    def test_nothing_merged_is_formatted_the_same(self):
+        # Even with nothing to merge, the output must be formatted the same
+        # way as a merged file, or it will flip between styles across pulls.
+        self.assertEqual(self._merge('a: "x"\nb: y\n', 'a: "x"\nb: y\n'), 'a: x\nb: y\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -20,10 +20,16 @@ Pulls and massages our translations from Transifex.
 
 import os
 import sys
-import errno
 import codecs
+import pickle
+import asyncio
 import argparse
-import requests
+import functools
+import threading
+import contextlib
+import multiprocessing
+import concurrent.futures
+import aiohttp
 import localizable
 from bs4 import BeautifulSoup
 from transifex.api import transifex_api
@@ -54,54 +60,106 @@ class YAML_StringDumper(YAML):
 TRANSLATION_COMPLETION_PRINT_THRESHOLD = 0.5
 
 
+# Translations below this completion fraction are not worth downloading.
+MIN_DOWNLOAD_COMPLETION = 0.01
+
+
 # Used when keeping track of untranslated strings during merging.
 UNTRANSLATED_FLAG = '[UNTRANSLATED]'
 
 
-# Transifex credentials. Must be of the form:
-#     {"api": <api token>}
-_config = None  # Don't use this directly. Call _getconfig()
+# The maximum number of translation downloads that will be in flight at once.
+# Keeps us within Transifex's rate limits.
+MAX_CONCURRENT_DOWNLOADS = 10
 
 
-def get_config():
-    global _config
-    if _config:
-        return _config
+# The Transifex API is synchronous, so its calls are run in this thread pool to
+# keep them off the event loop. (Each download preparation holds a thread while it
+# polls.) It's sized so that no more than MAX_CONCURRENT_DOWNLOADS Transifex calls
+# can be in flight at once, whatever the default executor's size.
+_tx_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=MAX_CONCURRENT_DOWNLOADS, thread_name_prefix='transifex')
 
-    API_TOKEN_FILENAME = 'transifex_api_token'
 
-    # Figure out where the config file is
-    parser = argparse.ArgumentParser(
-        description='Pull translations from Transifex')
-    parser.add_argument('api_token_file', default=None, nargs='?',
-                        help='Transifex API token file (default: ./{0})'.format(API_TOKEN_FILENAME))
-    args = parser.parse_args()
-    api_token_file = None
-    if args.api_token_file and os.path.exists(args.api_token_file):
+# The maximum number of simultaneous connections in an aiohttp download session.
+# This only limits fetching the prepared translation files; the Transifex API
+# calls (including preparing the downloads) are limited by MAX_CONCURRENT_DOWNLOADS.
+HTTP_CONNECTION_LIMIT = 16
+
+
+# Output directories that have already been created during this run.
+_made_dirs = set()
+
+
+API_TOKEN_FILENAME = 'transifex_api_token'
+
+# If set, this environment variable gives the path of the API token file.
+API_TOKEN_FILE_ENV_VAR = 'TRANSIFEX_API_TOKEN_FILE'
+
+# The API token file given on the command line. Set by get_config_from_cli().
+_cli_api_token_file = None
+
+
+def _find_token_file():
+    """Find the Transifex API token file. Returns None if there isn't one.
+    """
+    script_dir_token_file = os.path.join(
+        os.path.dirname(os.path.realpath(__file__)), API_TOKEN_FILENAME)
+
+    if _cli_api_token_file:
         # Use the script argument
-        api_token_file = args.api_token_file
+        return _cli_api_token_file
+    elif os.environ.get(API_TOKEN_FILE_ENV_VAR) and os.path.exists(os.environ[API_TOKEN_FILE_ENV_VAR]):
+        # Use the file from the environment
+        return os.environ[API_TOKEN_FILE_ENV_VAR]
     elif os.path.exists(API_TOKEN_FILENAME):
         # Use the API token in pwd
-        api_token_file = API_TOKEN_FILENAME
-    elif __file__ and os.path.exists(os.path.join(
-            os.path.dirname(os.path.realpath(__file__)),
-            API_TOKEN_FILENAME)):
+        return API_TOKEN_FILENAME
+    elif os.path.exists(script_dir_token_file):
         # Use the API token in the script dir
-        api_token_file = os.path.join(
-            os.path.dirname(os.path.realpath(__file__)),
-            API_TOKEN_FILENAME)
-    else:
+        return script_dir_token_file
+    return None
+
+
+@functools.lru_cache(maxsize=1)
+def get_config():
+    """Get the Transifex credentials. They are of the form:
+        {"api": <api token>}
+    The API token file is looked for in $TRANSIFEX_API_TOKEN_FILE, then in the
+    current directory, then in this script's directory. The command line is
+    only consulted if `get_config_from_cli` has been called.
+    """
+    api_token_file = _find_token_file()
+    if not api_token_file:
         print('Unable to find API token file')
         sys.exit(1)
 
     with open(api_token_file) as token_fp:
-        _config = {'api': token_fp.read().strip()}
+        config = {'api': token_fp.read().strip()}
 
-    if not _config:
+    if not config['api']:
         print('Unable to load config contents')
         sys.exit(1)
 
-    return _config
+    return config
+
+
+def get_config_from_cli():
+    """Like `get_config`, but first checks the command line for the API token file.
+    For use by scripts that don't have command line arguments of their own.
+    """
+    global _cli_api_token_file
+
+    parser = argparse.ArgumentParser(
+        description='Pull translations from Transifex')
+    parser.add_argument('api_token_file', default=None, nargs='?',
+                        help='Transifex API token file (default: ./{0})'.format(API_TOKEN_FILENAME))
+    args = parser.parse_args()
+    if args.api_token_file and os.path.exists(args.api_token_file):
+        _cli_api_token_file = args.api_token_file
+        get_config.cache_clear()
+
+    return get_config()
 
 
 def _decompose_resource_url(url: str) -> tuple[str, str, str]:
@@ -116,7 +174,8 @@ def _decompose_resource_url(url: str) -> tuple[str, str, str]:
 
 
 def process_resource(resource_url, langs, master_fpath, output_path_fn, output_mutator_fn,
-                     bom=False, encoding='utf-8', project='Psiphon3'):
+                     bom=False, encoding='utf-8', project='Psiphon3',
+                     min_completion=MIN_DOWNLOAD_COMPLETION, executor=None):
     """
     Pull translations for `resource_url` from transifex.
     `langs` is a dict of {<transifex language code>: <output language code>}.
@@ -126,14 +185,65 @@ def process_resource(resource_url, langs, master_fpath, output_path_fn, output_m
     `output_mutator_fn` must be callable. It will be passed `master_fpath, in_lang, out_lang, fname, translation`
     and must return the resulting translation. May be None.
     If `bom` is True, the file will have a BOM. File will be encoded with `encoding`.
+    Languages with a completion fraction below `min_completion` will not be
+    downloaded, and their existing output files will be left as they are.
+    (Languages missing from the resource stats are always downloaded.)
+    If `executor` is given (see `merge_process_pool`), `output_mutator_fn` will be
+    run in it, if it can be pickled (i.e., it's a module-level function). Otherwise
+    it's run in this process.
+    """
+    asyncio.run(process_resource_async(
+        resource_url, langs, master_fpath, output_path_fn, output_mutator_fn,
+        bom=bom, encoding=encoding, project=project, min_completion=min_completion,
+        executor=executor))
+
+
+def process_resources(resources, max_concurrency=8, executor=None):
+    """
+    Pull translations for multiple resources from transifex, concurrently.
+    `resources` is a list of dicts of keyword arguments for `process_resource`.
+    At most `max_concurrency` resources will be processed at a time.
+    `executor` is as for `process_resource`, and is shared by all the resources.
+    """
+
+    async def _one(semaphore, session, download_semaphore, executor, kwargs):
+        async with semaphore:
+            await process_resource_async(**kwargs, session=session,
+                                         download_semaphore=download_semaphore, executor=executor)
+
+    async def _all():
+        semaphore = asyncio.Semaphore(max_concurrency)
+        # The download limit applies across all resources, to stay within
+        # Transifex's rate limits.
+        download_semaphore = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS)
+        # Share one session, so connections get reused across resources.
+        async with _new_http_session() as session:
+            await asyncio.gather(*[_one(semaphore, session, download_semaphore, executor, kwargs)
+                                   for kwargs in resources])
+
+    asyncio.run(_all())
+
+
+async def process_resource_async(resource_url, langs, master_fpath, output_path_fn, output_mutator_fn,
+                                 bom=False, encoding='utf-8', project='Psiphon3',
+                                 min_completion=MIN_DOWNLOAD_COMPLETION, session=None,
+                                 download_semaphore=None, executor=None):
+    """
+    Coroutine version of `process_resource`, for running alongside other resources.
+    Takes the same arguments, plus:
+    `session`, an aiohttp session to download with. If None, a new one will be used.
+    `download_semaphore`, an asyncio semaphore limiting concurrent downloads, to
+    share the limit with other resources. If None, a new one of size
+    MAX_CONCURRENT_DOWNLOADS will be used.
+    `executor`, as for `process_resource`.
     """
 
     org_name, proj_name, resource_name = _decompose_resource_url(resource_url)
     print(f'\nResource: {resource_name}')
-    _, proj, resource = _get_tx_objects(org_name, proj_name, resource_name)
+    _, proj, resource = await _tx_call(_get_tx_objects, org_name, proj_name, resource_name)
 
     # Check for high-translation languages that we won't be pulling
-    stats = _tx_get_resource_stats(proj, resource)
+    stats = await _tx_call(_tx_get_resource_stats, proj, resource)
     for lang in stats:
         if stats[lang]['completion'] >= TRANSLATION_COMPLETION_PRINT_THRESHOLD:
             if lang not in langs and lang != 'en':
@@ -143,59 +253,145 @@ def process_resource(resource_url, langs, master_fpath, output_path_fn, output_m
                     f'({stats[lang]["translated_strings"]} of '
                     f'{stats[lang]["total_strings"]})')
 
-    for in_lang, out_lang in list(langs.items()):
-        print(f'Downloading {in_lang}...')
-        translation = _tx_download_translation_file(resource, in_lang)
+    async def _one(session, semaphore, executor, in_lang, out_lang):
+        if in_lang in stats and stats[in_lang]['completion'] < min_completion:
+            print(f'Skipping download of nearly untranslated language "{in_lang}"')
+            return
 
         output_path = output_path_fn(out_lang)
 
-        # Make sure the output directory exists.
-        try:
-            os.makedirs(os.path.dirname(output_path))
-        except OSError as ex:
-            if ex.errno == errno.EEXIST and os.path.isdir(os.path.dirname(output_path)):
-                pass
-            else:
-                raise
-
-        if output_mutator_fn:
+        # Make sure the output directory exists. Languages often share an
+        # output directory, so remember which ones we've already made.
+        output_dir = os.path.dirname(output_path)
+        if output_dir not in _made_dirs:
+            os.makedirs(output_dir, exist_ok=True)
+            _made_dirs.add(output_dir)
+
+        if not output_mutator_fn and codecs.lookup(encoding).name == 'utf-8':
+            # There's nothing to do to the translation but fix the line endings,
+            # so we can stream it straight to the file without decoding it.
+            async with semaphore:
+                print(f'Downloading {in_lang}...')
+                await _tx_download_translation_to_file(session, resource, in_lang, output_path, bom)
+            return
+
+        async with semaphore:
+            print(f'Downloading {in_lang}...')
+            translation = await _tx_download_translation_file(session, resource, in_lang)
+
+        if output_mutator_fn and executor:
+            # The caller has asked for merging to be done in another process.
+            content = await asyncio.get_running_loop().run_in_executor(
+                executor, output_mutator_fn,
+                master_fpath, in_lang, out_lang, output_path, translation)
+        elif output_mutator_fn:
             content = output_mutator_fn(
                 master_fpath, in_lang, out_lang, output_path, translation)
         else:
             content = translation
 
-        # Make line endings consistently Unix-y.
+        _write_translation_file(output_path, content, bom, encoding)
+
+    async with contextlib.AsyncExitStack() as stack:
+        if session is None:
+            session = await stack.enter_async_context(_new_http_session())
+
+        # Only a mutator that can be pickled can be sent to another process.
+        # Others (such as lambdas) are run in this one.
+        if executor and (not output_mutator_fn or not _is_picklable(output_mutator_fn)):
+            executor = None
+
+        # The downloads are network-bound, so run them all concurrently.
+        if download_semaphore is None:
+            download_semaphore = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS)
+        await asyncio.gather(*[_one(session, download_semaphore, executor, in_lang, out_lang)
+                               for in_lang, out_lang in langs.items()])
+
+
+def merge_process_pool(max_workers=None):
+    """
+    Create a process pool that can be passed as the `executor` to `process_resource`,
+    to run the output mutators (merging) in parallel. Only worth it for large
+    resources with many languages: each worker process has to import this module
+    and parse the master file itself. Should be used as a context manager.
+    The pool uses the "spawn" start method, which is safe alongside the download
+    threads; calling scripts must guard their entry point with `if __name__ == '__main__'`.
+    """
+    return concurrent.futures.ProcessPoolExecutor(
+        max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'))
+
+
+def _is_picklable(obj):
+    """Returns True if `obj` can be pickled (and so passed to another process).
+    """
+    try:
+        pickle.dumps(obj)
+    except Exception:
+        return False
+    return True
+
+
+def _new_http_session():
+    """Create an aiohttp session for downloading translation files. Its connections
+    are pooled (and kept alive), so it should be shared as widely as possible.
+    """
+    return aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=HTTP_CONNECTION_LIMIT))
+
+
+def _write_translation_file(output_path, content, bom, encoding):
+    """Write the translation `content` to `output_path`, with Unix-y line endings.
+    If `bom` is True, the file will have a BOM. File will be encoded with `encoding`.
+    """
+
+    # Make line endings consistently Unix-y. Most translations have no
+    # CRs at all, and checking for one is much cheaper than a replace.
+    if '\r' in content:
         content = content.replace('\r\n', '\n')
 
-        with codecs.open(output_path, 'w', encoding) as f:
-            if bom:
-                f.write('\N{BYTE ORDER MARK}')
+    if bom:
+        content = '\N{BYTE ORDER MARK}' + content
 
-            f.write(content)
+    # Encoding the BOM along with the content gives the correct bytes for
+    # any encoding, and lets us write the file in one go.
+    with open(output_path, 'wb', buffering=65536) as f:
+        f.write(content.encode(encoding))
+
+
+# Held while getting Transifex objects. The getters are cached, but lru_cache
+# doesn't stop concurrent callers that miss the cache from all making the call.
+_tx_objects_lock = threading.Lock()
 
 
-_tx_cache = {
-    'org': {},
-    'proj': {},
-    'resource': {},
-}
 def _get_tx_objects(org_name: str, proj_name: str, resource_name: str) -> tuple[object, object, object]:
     """Get the Transifex objects for the given names.
     """
-    global _tx_cache
+    with _tx_objects_lock:
+        return (_get_tx_org(org_name),
+                _get_tx_proj(org_name, proj_name),
+                _get_tx_resource(org_name, proj_name, resource_name))
 
+
+@functools.lru_cache(maxsize=1)
+def _tx_setup():
+    """Set up the Transifex API. Only needs to be done once per run.
+    """
     transifex_api.setup(auth=get_config()['api'])
 
-    if org_name not in _tx_cache['org']:
-        _tx_cache['org'][org_name] = transifex_api.Organization.get(id=org_name)
 
-    if proj_name not in _tx_cache['proj']:
-        _tx_cache['proj'][proj_name] = transifex_api.Project.get(organization=_tx_cache['org'][org_name], id=proj_name)
+@functools.lru_cache(maxsize=None)
+def _get_tx_org(org_name):
+    _tx_setup()
+    return transifex_api.Organization.get(id=org_name)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_tx_proj(org_name, proj_name):
+    return transifex_api.Project.get(organization=_get_tx_org(org_name), id=proj_name)
 
-    if resource_name not in _tx_cache['resource']:
-        _tx_cache['resource'][resource_name] = transifex_api.Resource.get(project=_tx_cache['proj'][proj_name], id=resource_name)
 
-    return _tx_cache['org'][org_name], _tx_cache['proj'][proj_name], _tx_cache['resource'][resource_name]
+@functools.lru_cache(maxsize=None)
+def _get_tx_resource(org_name, proj_name, resource_name):
+    return transifex_api.Resource.get(project=_get_tx_proj(org_name, proj_name), id=resource_name)
 
 
 def _tx_get_resource_stats(proj, resource):
@@ -204,7 +400,7 @@ def _tx_get_resource_stats(proj, resource):
     stats = transifex_api.ResourceLanguageStats.filter(project=proj, resource=resource)
     res = {}
     for stat in stats:
-        res[stat.language.id.lstrip('l:')] = {
+        res[stat.language.id.removeprefix('l:')] = {
             'completion': stat.translated_strings / stat.total_strings,
             'translated_strings': stat.translated_strings,
             'untranslated_strings': stat.untranslated_strings,
@@ -215,16 +411,75 @@ def _tx_get_resource_stats(proj, resource):
     return res
 
 
-def _tx_download_translation_file(resource, lang) -> str:
-    """Download a translation file from Transifex.
-    Returns the translation file as a string.
+async def _tx_call(fn, *args, **kwargs):
+    """Run the synchronous Transifex API call `fn` in the Transifex thread pool.
+    """
+    return await asyncio.get_running_loop().run_in_executor(
+        _tx_executor, functools.partial(fn, *args, **kwargs))
+
+
+async def _tx_get_download_url(resource, lang) -> str:
+    """Get the URL to download the translation file from.
     """
     lang = transifex_api.Language(id=f'l:{lang}')
-    download_url = transifex_api.ResourceTranslationsAsyncDownload.download(resource=resource, language=lang)
-    r = requests.get(download_url)
-    if r.status_code != 200:
-        raise Exception(f'Request failed with code {r.status_code}: {resource} {lang} {download_url}')
-    return r.text
+    # This polls until the download is ready, which can take a while.
+    return await _tx_call(
+        transifex_api.ResourceTranslationsAsyncDownload.download, resource=resource, language=lang)
+
+
+async def _tx_download_translation_file(session, resource, lang) -> str:
+    """Download a translation file from Transifex, using the aiohttp `session`.
+    Returns the translation file as a string.
+    """
+    download_url = await _tx_get_download_url(resource, lang)
+    async with session.get(download_url) as r:
+        if r.status != 200:
+            raise Exception(f'Request failed with code {r.status}: {resource} {lang} {download_url}')
+        return await r.text()
+
+
+async def _tx_download_translation_to_file(session, resource, lang, output_path, bom):
+    """Download a translation file from Transifex, using the aiohttp `session`,
+    and write it to `output_path` as UTF-8 with Unix-y line endings.
+    If `bom` is True, the file will have a BOM.
+    """
+    download_url = await _tx_get_download_url(resource, lang)
+    async with session.get(download_url) as r:
+        if r.status != 200:
+            raise Exception(f'Request failed with code {r.status}: {resource} {lang} {download_url}')
+
+        if r.charset and codecs.lookup(r.charset).name != 'utf-8':
+            # We can't use the bytes as they are, so go the long way around.
+            _write_translation_file(output_path, await r.text(), bom, 'utf-8')
+            return
+
+        # Download to a temporary file and only replace the existing translation
+        # once we have all of it, so a dropped connection can't truncate it.
+        temp_path = f'{output_path}.{os.getpid()}.tmp'
+        try:
+            with open(temp_path, 'wb', buffering=65536) as f:
+                if bom:
+                    f.write(codecs.BOM_UTF8)
+
+                pending_cr = False
+                async for chunk in r.content.iter_chunked(65536):
+                    if pending_cr:
+                        chunk = b'\r' + chunk
+                    # A CRLF may be split across chunks, so hold back a trailing CR
+                    # until we see what follows it.
+                    pending_cr = chunk.endswith(b'\r')
+                    if pending_cr:
+                        chunk = chunk[:-1]
+                    f.write(chunk.replace(b'\r\n', b'\n'))
+
+                if pending_cr:
+                    f.write(b'\r')
+
+            os.replace(temp_path, output_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
 
 
 #
@@ -242,6 +497,50 @@ def _tx_download_translation_file(resource, lang) -> str:
 # Note that all paths can be relative to cwd.
 #
 
+# Parsed master language files. The master file is the same for every language
+# of a resource, so we only want to parse it once. Keyed by path, with values of
+# (mtime, parsed); a modified file is parsed again and replaces the old entry.
+_parse_cache = {
+    'strings': {},
+    'yaml': {},
+}
+
+
+def _cached_parse(kind, path, parse_fn):
+    """Returns `parse_fn(path)`, reusing the result cached under `kind` if the
+    file hasn't changed. The result is shared, so must not be modified.
+    """
+    mtime = os.path.getmtime(path)
+    cached = _parse_cache[kind].get(path)
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, parse_fn(path))
+        _parse_cache[kind][path] = cached
+    return cached[1]
+
+
+def _cached_strings_by_key(path):
+    """Parse the `.strings` file at `path` into a dict of {<key>: <value>},
+    reusing the previous result if the file hasn't changed.
+    The result is shared, so must not be modified.
+    """
+    def _parse(path):
+        return {x['key']: x['value'] for x in localizable.parse_strings(filename=path)}
+    return _cached_parse('strings', path, _parse)
+
+
+def _cached_yaml_load(path):
+    """Load the YAML file at `path`, reusing the previous result if the
+    file hasn't changed. The result is shared, so must not be modified.
+    """
+    def _load(path):
+        # We only need the keys and values from this file, not its formatting,
+        # so use the (much faster) LibYAML-backed safe loader rather than
+        # the pure-Python round-trip one.
+        with codecs.open(path, encoding='utf-8') as f:
+            return YAML(typ='safe', pure=False).load(f)
+    return _cached_parse('yaml', path, _load)
+
+
 def merge_yaml_translations(master_fpath, in_lang, out_lang, trans_fpath, fresh_raw):
     """Merge YAML files (such as are used by Store Assets).
     Can be passed as a mutator to `process_resource`.
@@ -252,8 +551,7 @@ def merge_yaml_translations(master_fpath, in_lang, out_lang, trans_fpath, fresh_
 
     fresh_translation = yml.load(fresh_raw)
 
-    with codecs.open(master_fpath, encoding='utf-8') as f:
-        english_translation = yml.load(f)
+    english_translation = _cached_yaml_load(master_fpath)
 
     try:
         with codecs.open(trans_fpath, encoding='utf-8') as f:
@@ -282,7 +580,9 @@ def merge_yaml_translations(master_fpath, in_lang, out_lang, trans_fpath, fresh_
         fresh = fresh_translation
         existing = existing_translation
 
-    # Use existing translations for strings missing from the fresh translation
+    # Use existing translations for strings missing from the fresh translation.
+    # Note that the result is always dumped, even if nothing was merged, so that
+    # the output is consistently formatted from one pull to the next.
     for key in master:
         if not fresh.get(key) and existing.get(key):
             fresh[key] = existing.get(key)
@@ -299,55 +599,39 @@ def merge_applestrings_translations(master_fpath, in_lang, out_lang, trans_fpath
     Can be passed as a mutator to `process_resource`.
     """
 
-    # First flag all the untranslated entries, for later reference.
-    fresh_raw = _flag_untranslated_applestrings(
-        master_fpath, out_lang, trans_fpath, fresh_raw)
+    english_by_key = _cached_strings_by_key(master_fpath)
 
-    fresh_translation = localizable.parse_strings(content=fresh_raw)
-    english_translation = localizable.parse_strings(filename=master_fpath)
+    # First flag all the untranslated entries, for later reference.
+    fresh_translation = _flag_untranslated_applestrings(english_by_key, fresh_raw)
 
     try:
         existing_translation = localizable.parse_strings(filename=trans_fpath)
     except Exception as ex:
         print(f'merge_applestrings_translations: failed to open existing translation: {trans_fpath} -- {ex}\n')
-        return fresh_raw
+        return _serialize_applestrings(fresh_translation)
 
-    fresh_merged = ''
+    existing_by_key = {x['key']: x for x in existing_translation}
 
     for entry in fresh_translation:
-        try:
-            english = next(x['value']
-                           for x in english_translation if x['key'] == entry['key'])
-        except:
-            english = None
-
-        try:
-            existing = next(
-                x for x in existing_translation if x['key'] == entry['key'])
+        english = english_by_key.get(entry['key'])
 
+        existing = existing_by_key.get(entry['key'])
+        if existing is not None:
             # Make sure we don't fall back on an untranslated value. See comment
             # on function `flag_untranslated_*` for details.
             if UNTRANSLATED_FLAG in existing['comment']:
                 existing = None
             else:
                 existing = existing['value']
-        except:
-            existing = None
-
-        fresh_value = entry['value']
 
-        if fresh_value == english and existing is not None and existing != english:
+        if entry['value'] == english and existing is not None and existing != english:
             # The fresh translation has the English fallback
-            fresh_value = existing
-
-        escaped_fresh = fresh_value.replace('"', '\\"').replace('\n', '\\n')
+            entry['value'] = existing
 
-        fresh_merged += f'/*{entry["comment"]}*/\n"{entry["key"]}" = "{escaped_fresh}";\n\n'
+    return _serialize_applestrings(fresh_translation)
 
-    return fresh_merged
 
-
-def _flag_untranslated_applestrings(master_fpath, lang, trans_fpath, fresh_raw):
+def _flag_untranslated_applestrings(english_by_key, fresh_raw):
     """
     When retrieved from Transifex, Apple .strings files include all string table
     entries, with the English provided for untranslated strings. This counteracts
@@ -368,29 +652,31 @@ def _flag_untranslated_applestrings(master_fpath, lang, trans_fpath, fresh_raw):
     (An alternative approach that would also work: Remove any untranslated string
     table entries. But this seems more drastic than modifying a comment could have
     unforeseen side-effects.)
+
+    Returns the parsed entries of `fresh_raw`, with untranslated entries flagged.
+    `english_by_key` is a dict of {<key>: <English value>}.
     """
 
     fresh_translation = localizable.parse_strings(content=fresh_raw)
-    english_translation = localizable.parse_strings(filename=master_fpath)
-    fresh_flagged = ''
 
     for entry in fresh_translation:
-        try:
-            english = next(x['value']
-                           for x in english_translation if x['key'] == entry['key'])
-        except:
-            english = None
-
-        if entry['value'] == english:
+        if entry['value'] == english_by_key.get(entry['key']):
             # The string is untranslated, so flag the comment
             entry['comment'] = UNTRANSLATED_FLAG + entry['comment']
 
-        entry['value'] = entry['value'].replace(
-            '"', '\\"').replace('\n', '\\n')
+    return fresh_translation
+
+
+def _serialize_applestrings(entries):
+    """Serialize parsed `.strings` entries back into the file format.
+    """
+    serialized = []
 
-        fresh_flagged += f'/*{entry["comment"]}*/\n"{entry["key"]}" = "{entry["value"]}";\n\n'
+    for entry in entries:
+        escaped_value = entry['value'].replace('"', '\\"').replace('\n', '\\n')
+        serialized.append(f'/*{entry["comment"]}*/\n"{entry["key"]}" = "{escaped_value}";\n\n')
 
-    return fresh_flagged
+    return ''.join(serialized)
 
 
 def merge_html_translations(master_fpath, in_lang, out_lang, trans_fpath, fresh_raw):